@@ -100,7 +100,9 @@ class ResNet(nn.Module):
                            act=self.act)(x)
     x = jnp.mean(x, axis=(1, 2))
     x = nn.Dense(self.num_classes, dtype=self.dtype)(x)
-    x = jnp.asarray(x, self.dtype)
+    # Compute the log-softmax (and its gradient) in float32, bf16 does not have
+    # enough precision for log-probabilities close to zero.
+    x = jnp.asarray(x, jnp.float32)
     x = nn.log_softmax(x)
     return x
 
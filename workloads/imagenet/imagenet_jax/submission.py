@@ -1,6 +1,7 @@
 """Training algorithm track submission functions for ImageNet."""
 
 import functools
+import operator
 from typing import Iterator, List, Tuple
 
 import jax
@@ -18,27 +19,19 @@ def get_batch_size(workload_name):
   return 128
 
 
-def cosine_decay(lr, step, total_steps):
-  ratio = jnp.maximum(0., step / total_steps)
-  mult = 0.5 * (1. + jnp.cos(jnp.pi * ratio))
-  return mult * lr
-
-
 def create_learning_rate_fn(
     hparams: spec.Hyperparamters,
     steps_per_epoch: int):
   """Create learning rate schedule."""
   base_learning_rate = hparams.learning_rate * get_batch_size('imagenet') / 256.
-  warmup_fn = optax.linear_schedule(
-      init_value=0., end_value=base_learning_rate,
-      transition_steps=hparams.warmup_epochs * steps_per_epoch)
   cosine_epochs = max(hparams.num_epochs - hparams.warmup_epochs, 1)
-  cosine_fn = optax.cosine_decay_schedule(
-      init_value=base_learning_rate,
-      decay_steps=cosine_epochs * steps_per_epoch)
-  schedule_fn = optax.join_schedules(
-      schedules=[warmup_fn, cosine_fn],
-      boundaries=[hparams.warmup_epochs * steps_per_epoch])
+  schedule_fn = optax.warmup_cosine_decay_schedule(
+      init_value=0.,
+      peak_value=base_learning_rate,
+      warmup_steps=hparams.warmup_epochs * steps_per_epoch,
+      # Includes the warmup steps.
+      decay_steps=(hparams.warmup_epochs + cosine_epochs) * steps_per_epoch,
+      end_value=0.)
   return schedule_fn
 
 
@@ -59,26 +52,31 @@ def init_optimizer_state(
     model_state: spec.ModelAuxiliaryState,
     hyperparameters: spec.Hyperparamters,
     rng: spec.RandomState) -> spec.OptimizerState:
-  params_zeros_like = jax.tree_map(
-      lambda s: jnp.zeros(s.shape_tuple), workload.param_shapes)
   opt_init_fn, opt_update_fn = optimizer(
       hyperparameters, workload.num_train_examples)
-  optimizer_state = opt_init_fn(params_zeros_like)
+  # `model_params` are already replicated, so initialize the optimizer state
+  # from a single copy of them and replicate it afterwards.
+  optimizer_state = opt_init_fn(jax_utils.unreplicate(model_params))
+  # Wrap the update function in a Partial so it can be passed to the pmapped
+  # train step as a (leafless) pytree argument instead of a static one.
+  opt_update_fn = jax.tree_util.Partial(opt_update_fn)
   return jax_utils.replicate(optimizer_state), opt_update_fn
 
 
 # We need to jax.pmap here instead of inside update_params because the latter
-# would recompile the function every step.
+# would recompile the function every step. The model state, optimizer state and
+# parameters are donated so that XLA can update their buffers in place; callers
+# must not reuse them after the step.
 @functools.partial(
   jax.pmap,
   axis_name='batch',
-  in_axes=(None, None, 0, 0, 0, None, 0, None),
-  static_broadcasted_argnums=(0, 1))
+  in_axes=(None, None, 0, 0, 0, None, 0, 0),
+  static_broadcasted_argnums=(0,),
+  donate_argnums=(2, 3, 4))
 def pmapped_train_step(workload, opt_update_fn, model_state, optimizer_state,
                        current_param_container, hyperparameters, batch, rng):
   def _loss_fn(params):
     """loss function used for training."""
-    variables = {'params': params, **model_state}
     logits, new_model_state = workload.model_fn(
         params,
         batch,
@@ -87,10 +85,12 @@ def pmapped_train_step(workload, opt_update_fn, model_state, optimizer_state,
         rng,
         update_batch_norm=True)
     loss = workload.loss_fn(batch['label'], logits)
-    weight_penalty_params = jax.tree_leaves(variables['params'])
-    weight_l2 = sum([jnp.sum(x ** 2)
-                    for x in weight_penalty_params
-                    if x.ndim > 1])
+    # Only penalize kernels, not biases or batch norm scales.
+    weight_l2 = jax.tree_util.tree_reduce(
+        operator.add,
+        jax.tree_map(lambda x: jnp.sum(lax.square(x)) if x.ndim > 1 else 0.,
+                     params),
+        0.)
     weight_penalty = hyperparameters.l2 * 0.5 * weight_l2
     loss = loss + weight_penalty
     return loss, (new_model_state, logits)
@@ -120,14 +120,20 @@ def update_params(
     global_step: int,
     rng: spec.RandomState) -> spec.UpdateReturn:
   """Return (updated_optimizer_state, updated_params, updated_model_state)."""
+  del current_params_types
+  del loss_type
+  del eval_results
+
   batch = {
     'image': input_batch,
     'label': label_batch
   }
   optimizer_state, opt_update_fn = optimizer_state
+  # Give each replica its own key instead of broadcasting the same one.
+  per_device_rngs = jax.random.split(rng, jax.local_device_count())
   new_model_state, new_optimizer_state, new_params = pmapped_train_step(
     workload, opt_update_fn, model_state, optimizer_state,
-    current_param_container, hyperparameters, batch, rng)
+    current_param_container, hyperparameters, batch, per_device_rngs)
 
   steps_per_epoch = workload.num_train_examples // get_batch_size('imagenet')
   if (global_step + 1) % steps_per_epoch == 0:
@@ -7,7 +7,6 @@ python3 submission_runner.py \
 """
 import functools
 from typing import Tuple
-import optax
 
 import tensorflow as tf
 # Hide any GPUs form TensorFlow. Otherwise TF might reserve memory and make it
@@ -27,9 +26,46 @@ from . import input_pipeline
 from . import models
 
 
+def _fused_pmean(tree):
+  """Average a pytree across the 'x' axis with a single all-reduce.
+
+  All of the leaves are packed into one flat buffer so that only one collective
+  is issued instead of one per leaf.
+  """
+  leaves, treedef = jax.tree_util.tree_flatten(tree)
+  flat = jnp.concatenate([jnp.ravel(x) for x in leaves])
+  flat = lax.pmean(flat, 'x')
+  split_indices = np.cumsum([x.size for x in leaves])[:-1]
+  leaves = [
+    jnp.reshape(y, x.shape)
+    for x, y in zip(leaves, jnp.split(flat, split_indices))]
+  return jax.tree_util.tree_unflatten(treedef, leaves)
+
+
+# GPU families with bfloat16 tensor cores (compute capability >= 8.0). Older
+# GPUs, such as the V100 of the reference hardware, have no bf16 tensor cores
+# and would run a bf16 model slower than a float32 one.
+_BF16_GPU_KINDS = ('A100', 'A10', 'A30', 'A40', 'H100', 'L4')
+
+
+def _default_compute_dtype():
+  """Use bfloat16 compute only on devices with native support for it."""
+  device = jax.local_devices()[0]
+  if device.platform == 'tpu':
+    return jnp.bfloat16
+  if device.platform == 'gpu' and any(
+      kind in device.device_kind for kind in _BF16_GPU_KINDS):
+    return jnp.bfloat16
+  return jnp.float32
+
+
+# Defined once at module scope so that every call to `sync_batch_stats` reuses
+# the same compiled executable instead of re-tracing a fresh pmapped function.
+_cross_replica_mean = jax.pmap(_fused_pmean, axis_name='x')
+
 
 class ImagenetWorkload(spec.Workload):
-  def __init__(self):
+  def __init__(self, compute_dtype=None):
     self._eval_ds = None
     self._param_shapes = None
     self.epoch_metrics = []
@@ -40,6 +76,16 @@ class ImagenetWorkload(spec.Workload):
     self.model_name = '_ResNet1'
     self.dataset = 'imagenette'
     self.num_classes = 10
+    # The dtype the convolutions and matmuls run in, the parameters are always
+    # float32. Defaults to bfloat16 only on devices with bf16 tensor cores.
+    if compute_dtype is None:
+      compute_dtype = _default_compute_dtype()
+    self.compute_dtype = compute_dtype
+    # Fold (image - mean) / stddev into a single scale and shift, applied on
+    # device in `model_fn`.
+    self._norm_scale = 1. / np.array(self.train_stddev, dtype=np.float32)
+    self._norm_bias = -np.array(self.train_mean, dtype=np.float32) * (
+      self._norm_scale)
 
   def has_reached_goal(self, eval_result: float) -> bool:
     return eval_result['accuracy'] > self.target_value
@@ -108,10 +154,10 @@ class ImagenetWorkload(spec.Workload):
     ds = input_pipeline.create_input_iter(
       ds_builder,
       batch_size,
-      self.train_mean,
-      self.train_stddev,
       train=True,
-      cache=False)
+      # Imagenette fits in host memory, so cache the (undecoded) examples
+      # before shuffling to skip the file reads after the first epoch.
+      cache='imagenette' == self.dataset)
     return ds
 
   def build_input_queue(
@@ -120,6 +166,10 @@ class ImagenetWorkload(spec.Workload):
       split: str,
       data_dir: str,
       batch_size: int):
+    # `create_input_iter` already double-buffers the batches onto the local
+    # devices with `jax_utils.prefetch_to_device`, so the train step receives
+    # device-resident sharded arrays and no host to device copy happens on the
+    # critical path.
     return iter(self._build_dataset(data_rng, split, data_dir, batch_size))
 
   def sync_batch_stats(self, model_state):
@@ -127,9 +177,8 @@ class ImagenetWorkload(spec.Workload):
     # An axis_name is passed to pmap which can then be used by pmean.
     # In this case each device has its own version of the batch statistics and
     # we average them.
-    avg_fn = jax.pmap(lambda x: lax.pmean(x, 'x'), 'x')
     new_model_state = model_state.copy({
-      'batch_stats': avg_fn(model_state['batch_stats'])})
+      'batch_stats': _cross_replica_mean(model_state['batch_stats'])})
     return new_model_state
 
   @property
@@ -150,15 +199,16 @@ class ImagenetWorkload(spec.Workload):
       self,
       rng: spec.RandomState) -> _InitState:
     model_cls = getattr(models, self.model_name)
+    # The parameters are created (and updated by the optimizer) in float32
+    # regardless of the compute dtype.
     model = model_cls(num_classes=self.num_classes,
-                      dtype=jnp.float32)
+                      dtype=self.compute_dtype)
     self._model = model
     params, model_state = self.initialized(rng, model)
     self._param_shapes = jax.tree_map(
       lambda x: spec.ShapeTuple(x.shape),
       params)
-    model_state = jax_utils.replicate(model_state)
-    params = jax_utils.replicate(params)
+    params, model_state = jax_utils.replicate((params, model_state))
     return params, model_state
 
     # Keep this separate from the loss function in order to support optimizers
@@ -195,20 +245,34 @@ class ImagenetWorkload(spec.Workload):
       update_batch_norm: bool) -> Tuple[spec.Tensor, spec.ModelAuxiliaryState]:
     variables = {'params': params, **model_state}
     train = mode == spec.ForwardPassMode.TRAIN
+    # XLA fuses the normalization with the cast to the model dtype, so the
+    # images are only read once.
+    images = input_batch['image'] * self._norm_scale + self._norm_bias
+    images = images.astype(self._model.dtype)
     if update_batch_norm:
       logits, new_model_state = self._model.apply(
         variables,
-        jax.numpy.squeeze(input_batch['image']),
+        images,
         train=train,
         mutable=['batch_stats'])
-      return logits, new_model_state
     else:
       logits = self._model.apply(
         variables,
-        jax.numpy.squeeze(input_batch['image']),
+        images,
         train=train,
         mutable=False)
-      return logits, None
+      new_model_state = None
+    return logits, new_model_state
+
+  def _cross_entropy(self, label_batch, log_probs):
+    """Mean cross entropy of integer labels under the given log-probabilities.
+
+    Gathers the log-probability of the true class directly instead of
+    materializing a [batch, num_classes] one-hot label tensor.
+    """
+    labels = label_batch.astype(jnp.int32)[:, None]
+    xentropy = -jnp.take_along_axis(log_probs, labels, axis=-1)
+    return jnp.mean(xentropy)
 
   # Does NOT apply regularization, which is left to the submitter to do in
   # `update_params`.
@@ -217,14 +281,14 @@ class ImagenetWorkload(spec.Workload):
       label_batch: spec.Tensor,
       logits_batch: spec.Tensor) -> spec.Tensor:  # differentiable
     """Cross Entropy Loss"""
-    one_hot_labels = jax.nn.one_hot(label_batch,
-                                         num_classes=self.num_classes)
-    xentropy = optax.softmax_cross_entropy(logits=logits_batch,
-                                           labels=one_hot_labels)
-    return jnp.mean(xentropy)
+    log_probs = jax.nn.log_softmax(logits_batch)
+    return self._cross_entropy(label_batch, log_probs)
 
   def compute_metrics(self, logits, labels):
-    loss = self.loss_fn(labels, logits)
+    # The ResNet already ends with a log-softmax, so its outputs are
+    # log-probabilities and both the loss and the predictions are read from
+    # them directly, without normalizing them a second time.
+    loss = self._cross_entropy(labels, logits)
     accuracy = jnp.mean(jnp.argmax(logits, -1) == labels)
     metrics = {
       'loss': loss,
@@ -245,22 +309,35 @@ class ImagenetWorkload(spec.Workload):
 
     eval_metrics = []
     data_rng, model_rng = prng.split(rng, 2)
-    eval_batch_size = 200
-    num_batches = self.num_eval_examples // eval_batch_size
+    # Use up to 128 examples per device so that each eval pmap launch (and its
+    # metrics pmean) is amortized over enough work, then spread the eval set
+    # evenly over that many batches so that the dropped remainder stays smaller
+    # than one example per device per batch.
+    num_devices = jax.device_count()
+    max_eval_batch_size = min(128 * num_devices, self.num_eval_examples)
+    num_batches = -(-self.num_eval_examples // max_eval_batch_size)
+    eval_batch_size = (
+      self.num_eval_examples // num_batches // num_devices * num_devices)
+    if eval_batch_size == 0:
+      raise ValueError(
+        f'Cannot evaluate {self.num_eval_examples} examples on {num_devices} '
+        'devices, need at least one example per device.')
     if self._eval_ds is None:
       self._eval_ds = self._build_dataset(
         data_rng, split='test', batch_size=eval_batch_size, data_dir=data_dir)
     eval_iter = iter(self._eval_ds)
-    total_accuracy = 0.
-    for idx in range(num_batches):
+    for _ in range(num_batches):
       batch = next(eval_iter)
       synced_metrics = self.eval_model_fn(params, batch, model_state, rng)
       eval_metrics.append(synced_metrics)
-      total_accuracy += jnp.mean(synced_metrics['accuracy'])
 
-    eval_metrics = jax.device_get(jax.tree_map(lambda x: x[0], eval_metrics))
-    eval_metrics = jax.tree_multimap(lambda *x: np.stack(x), *eval_metrics)
-    summary = jax.tree_map(lambda x: x.mean(), eval_metrics)
+    # The metrics are already averaged across replicas, so only replica 0 is
+    # needed; indexing a ShardedDeviceArray with [0] returns that device buffer
+    # without a copy. Reduce over batches on device and transfer the summary
+    # back to the host once.
+    summary = jax.tree_multimap(
+      lambda *x: jnp.stack([y[0] for y in x]).mean(), *eval_metrics)
+    summary = jax.device_get(summary)
     return summary
 
 